@@ -22,6 +22,10 @@ from requests.adapters import HTTPAdapter
 import re
 from bassa.errors import InvalidUrl, Error, IncompleteParams, ResponseError
 from bassa.utils import TimeoutHTTPAdapter
+from bassa import compression, export, pool, transfer
+
+
+DOWNLOADS_PAGE_SIZE = 25  # records per page of /api/downloads
 
 
 class Bassa:
@@ -31,23 +35,30 @@ class Bassa:
         total (int): total number of tries for each request
         backoff_factor (int): It is used to determine the delay between each retry
         follows this formulation {backoff factor} * (2 ** ({number of total retries} - 1))
-        timeout (int): duration in seconds to wait until cancellation
+        timeout (int): duration in seconds to wait until cancellation, every
+        method also accepts a Deadline cutting it down to the time left
         api_url (str): URL to the Bassa Server
+        pool_size (int): maximum number of keep-alive connections kept per host
+        warm_connections (int): number of connections to open at construction
 
 
     Returns:
         None
     """
-    def __init__(self, api_url, total=1, backoff_factor=1, timeout=5):
+    def __init__(self, api_url, total=1, backoff_factor=1, timeout=5,
+                 pool_size=10, warm_connections=0):
         retries = Retry(total=total,
                         backoff_factor=backoff_factor,
                         status_forcelist=[429, 500, 502, 503, 504])
         http = requests.Session()
         http.mount("https://",
-                   TimeoutHTTPAdapter(max_retries=retries, timeout=timeout))
+                   TimeoutHTTPAdapter(max_retries=retries, timeout=timeout,
+                                      pool_maxsize=pool_size))
         http.mount("http://",
-                   TimeoutHTTPAdapter(max_retries=retries, timeout=timeout))
+                   TimeoutHTTPAdapter(max_retries=retries, timeout=timeout,
+                                      pool_maxsize=pool_size))
         self.http = http
+        self.timeout = timeout
         reg = re.compile(
             r'^(?:http|ftp)s?://'  # http:// or https://
             # domain...
@@ -64,16 +75,68 @@ class Bassa:
         self.headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
         }
+        self._keepalive = None
+        if warm_connections:
+            self.warm(connections=warm_connections)
+
+    # Connection functions
+
+    def warm(self, connections=4, user_name=None, password=None,
+             keepalive_interval=None, deadline=None):
+        """Open pooled connections and optionally log in ahead of time
+
+        Args:
+            connections (int): number of keep-alive connections to open
+            user_name (str): Name of the user to log in with
+            password (str): Password of the user
+            keepalive_interval (float): seconds between background checks
+            replacing dropped connections, None to not check
+            deadline (Deadline): time budget and cancellation token of the call
+
+        Returns:
+            number of connections open in the pool
+        """
+        opened = pool.warm_pool(self.http, self.api_url, connections,
+                                timeout=self.timeout, deadline=deadline)
+        if user_name is not None or password is not None:
+            self.login(user_name=user_name, password=password,
+                       deadline=deadline)
+        if keepalive_interval is not None:
+            if self._keepalive is not None:
+                self._keepalive.stop()
+            self._keepalive = pool.KeepAliveChecker(
+                self.http, self.api_url, keepalive_interval,
+                timeout=self.timeout)
+            self._keepalive.start()
+        return opened
+
+    def close(self):
+        """Stop the keep-alive checker and close all pooled connections
+
+        Returns:
+            None
+        """
+        if self._keepalive is not None:
+            self._keepalive.stop()
+            self._keepalive = None
+        self.http.close()
+
+    def _timeout(self, deadline):
+        """Timeout of a single request made on behalf of ``deadline``"""
+        if deadline is None:
+            return None
+        return deadline.timeout(self.timeout)
 
     # User functions
 
-    def login(self, user_name=None, password=None):
+    def login(self, user_name=None, password=None, deadline=None):
         """Login to the Bassa Server.
 
 
         Args:
             user_name (str): Name of the user
             password (str): Password of the user
+            deadline (Deadline): time budget and cancellation token of the call
 
 
         Returns:
@@ -88,7 +151,8 @@ class Bassa:
         params['password'] = password
         result = self.http.post(api_url_complete,
                                 data=params,
-                                headers=self.headers)
+                                headers=self.headers,
+                                timeout=self._timeout(deadline))
         if result.status_code == 200:
             self.headers['token'] = result.headers.get('token')
         else:
@@ -97,7 +161,8 @@ class Bassa:
     def add_regular_user_request(self,
                                  user_name=None,
                                  password=None,
-                                 email=None):
+                                 email=None,
+                                 deadline=None):
         """Add user requests with auth level 1.
 
 
@@ -105,6 +170,7 @@ class Bassa:
             user_name (str): Name of the user
             password (str): Password of the user
             email (str): Email ID of the user
+            deadline (Deadline): time budget and cancellation token of the call
 
 
         Returns:
@@ -121,13 +187,15 @@ class Bassa:
 
         result = self.http.post(api_url_complete,
                                 data=params,
-                                headers=self.headers)
+                                headers=self.headers,
+                                timeout=self._timeout(deadline))
 
     def add_user_request(self,
                          user_name=None,
                          password=None,
                          email=None,
-                         auth_level=1):
+                         auth_level=1,
+                         deadline=None):
         """Add user requests with auth level 1 or 0
 
 
@@ -136,6 +204,7 @@ class Bassa:
             password (str):   Password of the user
             email (str): Email ID of the user
             auth_level (int): Auth level of the user, 0 for admins and 1 for regular users
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -152,13 +221,15 @@ class Bassa:
 
         result = self.http.post(api_url_complete,
                                 data=params,
-                                headers=self.headers)
+                                headers=self.headers,
+                                timeout=self._timeout(deadline))
 
-    def remove_user_request(self, user_name=None):
+    def remove_user_request(self, user_name=None, deadline=None):
         """Remove a user request
 
         Args:
             user_name (str):    Name of the user
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -168,14 +239,16 @@ class Bassa:
         endpoint = "/api/user"
         api_url_complete = self.api_url + endpoint + "/" + user_name
 
-        result = self.http.delete(api_url_complete, headers=self.headers)
+        result = self.http.delete(api_url_complete, headers=self.headers,
+                                  timeout=self._timeout(deadline))
 
     def update_user_request(self,
                             user_name=None,
                             new_user_name=None,
                             password=None,
                             auth_level=None,
-                            email=None):
+                            email=None,
+                            deadline=None):
         """Update a user request
 
         Args:
@@ -184,6 +257,7 @@ class Bassa:
             password (str): New password for the user
             auth_level (int): Auth level for the new user, 0 for admins and 1 for regular users
             email (str): Email ID for the new user
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -200,41 +274,51 @@ class Bassa:
 
         result = self.http.put(api_url_complete,
                                data=params,
-                               headers=self.headers)
+                               headers=self.headers,
+                               timeout=self._timeout(deadline))
 
-    def get_user_request(self):
+    def get_user_request(self, deadline=None):
         """Get a user request
 
 
+        Args:
+            deadline (Deadline): time budget and cancellation token of the call
+
         Returns:
             response as json
         """
         endpoint = "/api/user"
         api_url_complete = self.api_url + endpoint
 
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
-    def get_user_signup_requests(self):
+    def get_user_signup_requests(self, deadline=None):
         """Get all user requests
 
 
+        Args:
+            deadline (Deadline): time budget and cancellation token of the call
+
         Returns:
             response as json
         """
         endpoint = "/api/user/requests"
         api_url_complete = self.api_url + endpoint
 
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
-    def approve_user_request(self, user_name=None):
+    def approve_user_request(self, user_name=None, deadline=None):
         """Approve a user request
 
         Args:
             user_name (str): Name of the user
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -244,12 +328,14 @@ class Bassa:
         if user_name is None:
             raise IncompleteParams
 
-        result = self.http.post(api_url_complete, headers=self.headers)
+        result = self.http.post(api_url_complete, headers=self.headers,
+                                timeout=self._timeout(deadline))
 
-    def get_blocked_users_request(self):
+    def get_blocked_users_request(self, deadline=None):
         """Get all blocked user requests 
 
         Args:
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             response as json
@@ -257,15 +343,17 @@ class Bassa:
         endpoint = "/api/user/blocked"
         api_url_complete = self.api_url + endpoint
 
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
-    def block_user_request(self, user_name=None):
+    def block_user_request(self, user_name=None, deadline=None):
         """Block a user request
 
         Args:
             user_name (str): Name of the user
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -274,13 +362,15 @@ class Bassa:
         if user_name is None:
             raise IncompleteParams
         api_url_complete = self.api_url + endpoint + "/" + user_name
-        result = self.http.post(api_url_complete, headers=self.headers)
+        result = self.http.post(api_url_complete, headers=self.headers,
+                                timeout=self._timeout(deadline))
 
-    def unblock_user_request(self, user_name=None):
+    def unblock_user_request(self, user_name=None, deadline=None):
         """Unblock a user request
 
         Args:
             user_name (str): Name of the user
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -289,13 +379,15 @@ class Bassa:
         if user_name is None:
             raise IncompleteParams
         api_url_complete = self.api_url + endpoint + "/" + user_name
-        result = self.http.delete(api_url_complete, headers=self.headers)
+        result = self.http.delete(api_url_complete, headers=self.headers,
+                                  timeout=self._timeout(deadline))
 
-    def get_downloads_user_request(self, limit=1):
+    def get_downloads_user_request(self, limit=1, deadline=None):
         """Get downloads user request
 
         Args:
             limit (int): Number of records to return. limit 1 = 25 records
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             response as json
@@ -303,31 +395,35 @@ class Bassa:
         endpoint = "/api/user/downloads"
         api_url_complete = self.api_url + endpoint + "/" + str(limit)
 
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
-    def get_topten_heaviest_users(self):
+    def get_topten_heaviest_users(self, deadline=None):
         """Get top ten user usage
 
         Args:
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             response as json
         """
         endpoint = "/api/user/heavy"
         api_url_complete = self.api_url + endpoint
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
     # Download functions
 
-    def start_download(self, server_key="123456789"):
+    def start_download(self, server_key="123456789", deadline=None):
         """Start downloading files which have been queued
 
         Args:
              server_key (str): secret server key which you would set in the Bassa Server
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -335,15 +431,17 @@ class Bassa:
         endpoint = "/api/download/start"
         api_url_complete = self.api_url + endpoint
         self.headers['key'] = server_key
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
-    def kill_download(self, server_key="123456789"):
+    def kill_download(self, server_key="123456789", deadline=None):
         """Kill all downloading files 
 
         Args:
              server_key (str): secret server key which you would set in the Bassa Server
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -351,15 +449,17 @@ class Bassa:
         endpoint = "/api/download/kill"
         api_url_complete = self.api_url + endpoint
         self.headers['key'] = server_key
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
-    def add_download_request(self, download_link=None):
+    def add_download_request(self, download_link=None, deadline=None):
         """Add a download request
 
         Args:
             download_link (str): Link to the download the resource
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -373,15 +473,17 @@ class Bassa:
         api_url_complete = self.api_url + endpoint
         result = self.http.post(api_url_complete,
                                 data=params,
-                                headers=self.headers)
+                                headers=self.headers,
+                                timeout=self._timeout(deadline))
         if result.status_code != requests.codes.ok:
             raise Exception("Add download was not successful")
 
-    def remove_download_request(self, id=None):
+    def remove_download_request(self, id=None, deadline=None):
         """Remove a download request
 
         Args:
             id (int): id of the download request 
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -390,14 +492,16 @@ class Bassa:
             raise IncompleteParams
         endpoint = "/api/download"
         api_url_complete = self.api_url + endpoint + "/" + str(id)
-        result = self.http.delete(api_url_complete, headers=self.headers)
+        result = self.http.delete(api_url_complete, headers=self.headers,
+                                  timeout=self._timeout(deadline))
 
-    def rate_download_request(self, id=None, rate=None):
+    def rate_download_request(self, id=None, rate=None, deadline=None):
         """Rate a download request
 
         Args:
             id (int): id of the download request
             rate (int): rating for the download request
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             None
@@ -411,13 +515,15 @@ class Bassa:
 
         result = self.http.post(api_url_complete,
                                 data=params,
-                                headers=self.headers)
+                                headers=self.headers,
+                                timeout=self._timeout(deadline))
 
-    def get_downloads_request(self, limit=None):
+    def get_downloads_request(self, limit=None, deadline=None):
         """Get all download requests
 
         Args:
             limit (int): Number of records to return. limit 1 = 25 records
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             returns response as json
@@ -427,17 +533,73 @@ class Bassa:
         endpoint = "/api/downloads"
         api_url_complete = self.api_url + endpoint + "/" + str(limit)
 
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
         else:
             raise Exception(result.status_code)
 
-    def get_download(self, id=None):
+    def iter_download_pages(self, start=1, deadline=None):
+        """Lazily iterate over the pages of all download requests
+
+        Args:
+            start (int): first page to fetch, page 1 holds the first 25 records
+            deadline (Deadline): time budget and cancellation token of the call
+
+        Returns:
+            generator of (page, records) tuples
+        """
+        page = start
+        while True:
+            records = self.get_downloads_request(limit=page,
+                                                 deadline=deadline)
+            if not records:
+                return
+            yield page, records
+            if len(records) < DOWNLOADS_PAGE_SIZE:
+                return
+            page += 1
+
+    def iter_downloads(self, start=1, deadline=None):
+        """Lazily iterate over all download requests
+
+        Args:
+            start (int): first page to fetch, page 1 holds the first 25 records
+            deadline (Deadline): time budget and cancellation token of the call
+
+        Returns:
+            generator of records as json
+        """
+        for _, records in self.iter_download_pages(start=start,
+                                                   deadline=deadline):
+            for record in records:
+                yield record
+
+    def export_downloads(self, path=None, format="jsonl", resume=True,
+                         deadline=None):
+        """Export all download requests to a JSONL, CSV or columnar file
+
+        Args:
+            path (str): output file
+            format (str): one of "jsonl", "csv" or "columnar"
+            resume (bool): continue an interrupted export from its last page
+            deadline (Deadline): time budget and cancellation token of the call
+
+        Returns:
+            number of records written
+        """
+        if path is None:
+            raise IncompleteParams
+        return export.export_downloads(self, path, format=format,
+                                       resume=resume, deadline=deadline)
+
+    def get_download(self, id=None, deadline=None):
         """Get all download requests
 
         Args:
             id (int): id of the download
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             returns response as json
@@ -446,20 +608,22 @@ class Bassa:
             raise IncompleteParams
         endpoint = "/api/download"
         api_url_complete = self.api_url + endpoint + "/" + str(id)
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
     # File functions
 
-    def start_compression(self, gid_list=None):
+    def start_compression(self, gid_list=None, deadline=None):
         """Start compression of the given files
 
         Args:
             gid_list (List): list of file identifiers to compress
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
-            returns response
+            returns response as json, holding the compression id
         """
         if gid_list is None:
             raise IncompleteParams
@@ -469,13 +633,19 @@ class Bassa:
         params['gid'] = gid_list
         result = self.http.post(api_url_complete,
                                 data=params,
-                                headers=self.headers)
+                                headers=self.headers,
+                                timeout=self._timeout(deadline))
+        if result.status_code == requests.codes.ok:
+            return result.json()
+        else:
+            raise ResponseError('API response: {}'.format(result.status_code))
 
-    def get_compression_progress(self, id=None):
+    def get_compression_progress(self, id=None, deadline=None):
         """Get all download requests
 
         Args:
             id (int): compression id
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             returns response as json
@@ -484,15 +654,17 @@ class Bassa:
             raise IncompleteParams
         endpoint = "/api/compression-progress"
         api_url_complete = self.api_url + endpoint + "/" + str(id)
-        result = self.http.get(api_url_complete, headers=self.headers)
+        result = self.http.get(api_url_complete, headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
 
-    def send_file_from_path(self, id=None):
+    def send_file_from_path(self, id=None, deadline=None):
         """Get all download requests
 
         Args:
             id (int): id of the file
+            deadline (Deadline): time budget and cancellation token of the call
 
         Returns:
             returns response as json
@@ -505,6 +677,87 @@ class Bassa:
         api_url_complete = self.api_url + endpoint
         result = self.http.get(api_url_complete,
                                params=params,
-                               headers=self.headers)
+                               headers=self.headers,
+                               timeout=self._timeout(deadline))
         if result.status_code == requests.codes.ok:
             return result.json()
+
+    def stream_file(self, id=None, byte_range=None, deadline=None):
+        """Open a streamed download of a completed file
+
+        Args:
+            id (int): id of the file
+            byte_range (tuple): optional inclusive (start, end) byte range
+            deadline (Deadline): time budget and cancellation token of the call
+
+        Returns:
+            streamed response, status 206 when the range was honoured and
+            416 when it lies past the end of the file
+        """
+        if id is None:
+            raise IncompleteParams
+        endpoint = "/api/file"
+        params = {}
+        params['gid'] = id
+        headers = dict(self.headers)
+        if byte_range is not None:
+            headers['Range'] = 'bytes={}-{}'.format(*byte_range)
+        api_url_complete = self.api_url + endpoint
+        result = self.http.get(api_url_complete,
+                               params=params,
+                               headers=headers,
+                               stream=True,
+                               timeout=self._timeout(deadline))
+        expected = (requests.codes.ok, requests.codes.partial_content)
+        if byte_range is not None:
+            expected += (requests.codes.range_not_satisfiable,)
+        if result.status_code not in expected:
+            result.close()
+            raise ResponseError('API response: {}'.format(result.status_code))
+        return result
+
+    def fetch_files(self, gid_list=None, dest=None, max_workers=4,
+                    bytes_per_second=None, deadline=None):
+        """Download many completed files in parallel
+
+        Args:
+            gid_list (List): list of file identifiers to fetch
+            dest (str): directory to write the files into
+            max_workers (int): maximum number of concurrent requests
+            bytes_per_second (int): global bandwidth budget, None for unlimited
+            deadline (Deadline): time budget and cancellation token of the call
+
+        Returns:
+            dict mapping every gid to the path of its file
+        """
+        if gid_list is None or dest is None:
+            raise IncompleteParams
+        return transfer.fetch_files(self, gid_list, dest,
+                                    max_workers=max_workers,
+                                    bytes_per_second=bytes_per_second,
+                                    deadline=deadline)
+
+    def compress_and_fetch(self, gid_list=None, dest=None, batch_size=None,
+                           max_workers=4, bytes_per_second=None,
+                           deadline=None):
+        """Compress files on the server and download the archives
+
+        Args:
+            gid_list (List): list of file identifiers to compress
+            dest (str): directory to write the archives into
+            batch_size (int): maximum number of files per compression job
+            max_workers (int): maximum number of concurrent downloads
+            bytes_per_second (int): global bandwidth budget, None for unlimited
+            deadline (Deadline): time budget and cancellation token of the call
+
+        Returns:
+            the compression id, or a list of ids in job order when the
+            gids were split into several jobs
+        """
+        if gid_list is None or dest is None:
+            raise IncompleteParams
+        return compression.compress_and_fetch(
+            self, gid_list, dest,
+            batch_size=batch_size or compression.BATCH_SIZE,
+            max_workers=max_workers, bytes_per_second=bytes_per_second,
+            deadline=deadline)
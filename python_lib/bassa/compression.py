@@ -0,0 +1,117 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compression jobs: start, await and fetch archives in one operation."""
+
+
+import time
+
+from bassa.errors import IncompleteParams, ResponseError
+from bassa.utils import Deadline
+from bassa import transfer
+
+BATCH_SIZE = 100  # files per compression job
+POLL_INTERVAL = 0.5  # seconds before the first progress check
+MAX_POLL_INTERVAL = 10  # seconds between progress checks at most
+MAX_WAIT = 3600  # seconds a compression job may take at most
+
+
+def _compression_id(response):
+    """Extract the process id from the start_compression response"""
+    if not isinstance(response, dict) or response.get("process_id") is None:
+        raise ResponseError('No process_id in {}'.format(response))
+    return response["process_id"]
+
+
+def is_complete(progress):
+    """Tell whether a get_compression_progress response reports completion
+
+    The server answers {"progress": <percentage>}. Anything else, including
+    no answer at all, means the job cannot be followed and raises.
+    """
+    value = progress.get("progress") if isinstance(progress, dict) else None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) \
+            or not 0 <= value <= 100:
+        raise ResponseError('Unexpected compression progress {}'.format(
+            progress))
+    return value == 100
+
+
+def compress_and_fetch(client, gid_list, dest, batch_size=BATCH_SIZE,
+                       max_workers=4, bytes_per_second=None,
+                       poll_interval=POLL_INTERVAL,
+                       max_poll_interval=MAX_POLL_INTERVAL,
+                       max_wait=MAX_WAIT, deadline=None):
+    """Compress files on the server and stream every archive to disk
+
+    The gids are split into jobs of at most ``batch_size`` files, which the
+    server compresses concurrently. The calling thread starts the jobs and
+    polls the running ones together with an interval that backs off from
+    ``poll_interval`` to ``max_poll_interval``. Each archive is handed to
+    one shared transfer.Fetcher as soon as its job completes rather than
+    after the slowest one, so no more than ``max_workers`` downloads are
+    open at once and together they stay within ``bytes_per_second``.
+
+    Args:
+        client (Bassa): logged in client
+        gid_list (List): list of file identifiers to compress
+        dest (str): directory to write the archives into
+        batch_size (int): maximum number of files per compression job
+        max_workers (int): maximum number of concurrent downloads
+        bytes_per_second (int): global bandwidth budget, None for unlimited
+        poll_interval (float): seconds before the first progress check
+        max_poll_interval (float): seconds between progress checks at most
+        max_wait (float): seconds to wait for the compression jobs at most
+        deadline (Deadline): time budget and cancellation token of the call
+
+    Returns:
+        the compression id, or a list of ids in job order when the gids
+        were split into several jobs
+    """
+    if not gid_list or dest is None:
+        raise IncompleteParams
+    if deadline is None:
+        deadline = Deadline()
+    gid_list = list(gid_list)
+    batches = [gid_list[i:i + batch_size]
+               for i in range(0, len(gid_list), batch_size)]
+    with transfer.Fetcher(client, dest, max_workers=max_workers,
+                          bytes_per_second=bytes_per_second,
+                          deadline=deadline) as fetcher:
+        ids = [_compression_id(client.start_compression(gids,
+                                                        deadline=deadline))
+               for gids in batches]
+        give_up = time.monotonic() + max_wait
+        pending = list(ids)
+        interval = poll_interval
+        while pending:
+            running = []
+            for id in pending:
+                if is_complete(client.get_compression_progress(
+                        id, deadline=deadline)):
+                    fetcher.add(id)
+                else:
+                    running.append(id)
+            if not running:
+                break
+            if time.monotonic() >= give_up:
+                raise ResponseError(
+                    'Compression of {} not done after {} seconds'.format(
+                        running, max_wait))
+            if len(running) < len(pending):
+                interval = poll_interval
+            pending = running
+            deadline.wait(interval)
+            interval = min(interval * 2, max_poll_interval)
+        fetcher.join()
+    return ids[0] if len(ids) == 1 else ids
@@ -32,3 +32,13 @@ class IncompleteParams(Error):
 class ResponseError(Error):
     """Raised for an unsuccessful response from the server"""
     pass
+
+
+class DeadlineExceeded(Error):
+    """Raised when the time budget of an operation has run out"""
+    pass
+
+
+class Cancelled(Error):
+    """Raised when an operation has been cancelled"""
+    pass
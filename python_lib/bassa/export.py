@@ -0,0 +1,306 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming export of the download history to JSONL, CSV or columnar files."""
+
+
+import csv
+import io
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+from bassa.errors import IncompleteParams, Error
+from bassa.utils import Deadline, DEFAULT_TIMEOUT
+
+FORMATS = ("jsonl", "csv", "columnar")
+COLUMNAR_MAGIC = b"BCOL1\n"
+_BLOCK_HEADER = struct.Struct(">I")
+_DONE = object()
+
+
+def _checkpoint_path(path):
+    return path + ".ckpt"
+
+
+def _widened_path(path):
+    return path + ".widen"
+
+
+def _load_checkpoint(path, fmt):
+    try:
+        with open(_checkpoint_path(path)) as f:
+            checkpoint = json.load(f)
+    except (IOError, ValueError):
+        checkpoint = None
+    if checkpoint is not None and checkpoint.get("format") == "csv":
+        _recover_widened(path, checkpoint)
+    if checkpoint is None or checkpoint.get("format") != fmt \
+            or not os.path.exists(path):
+        return None
+    return checkpoint
+
+
+def _recover_widened(path, checkpoint):
+    """Finish or drop a CSV rewrite interrupted by a crash
+
+    The rewritten file is complete once the checkpoint describes it, and is
+    moved into place. Otherwise the checkpoint still describes the original
+    file and the rewrite is thrown away.
+    """
+    widened = _widened_path(path)
+    if not os.path.exists(widened):
+        return
+    header = _header("csv", checkpoint.get("fields") or [])
+    with open(widened, "rb") as f:
+        complete = f.read(len(header)) == header and \
+            os.path.getsize(widened) == checkpoint.get("offset")
+    if complete:
+        os.replace(widened, path)
+    else:
+        os.remove(widened)
+
+
+def _save_checkpoint(path, checkpoint):
+    tmp = _checkpoint_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, _checkpoint_path(path))
+
+
+def _field_names(records):
+    fields = []
+    for record in records:
+        for name in record:
+            if name not in fields:
+                fields.append(name)
+    return fields
+
+
+def _encode_jsonl(records, fields):
+    return "".join(json.dumps(r, default=str) + "\n"
+                   for r in records).encode("utf-8")
+
+
+def _encode_csv(records, fields):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore")
+    writer.writerows(records)
+    return buf.getvalue().encode("utf-8")
+
+
+def _encode_columnar(records, fields):
+    # Every block names its own columns, so keys that only show up on
+    # later pages are kept without rewriting earlier blocks.
+    columns = dict((name, [r.get(name) for r in records])
+                   for name in _field_names(records))
+    block = zlib.compress(
+        json.dumps({"rows": len(records), "columns": columns},
+                   default=str).encode("utf-8"))
+    return _BLOCK_HEADER.pack(len(block)) + block
+
+
+_ENCODERS = {
+    "jsonl": _encode_jsonl,
+    "csv": _encode_csv,
+    "columnar": _encode_columnar,
+}
+
+
+def _header(fmt, fields):
+    if fmt == "csv":
+        buf = io.StringIO()
+        csv.writer(buf).writerow(fields)
+        return buf.getvalue().encode("utf-8")
+    if fmt == "columnar":
+        return COLUMNAR_MAGIC
+    return b""
+
+
+def _widen_csv(out, path, checkpoint, new_fields):
+    """Rewrite the CSV file ``out`` with the columns ``new_fields``
+
+    New columns are only ever appended, so the header is replaced and the
+    rows already written are padded with empty values in one streaming
+    copy. The checkpoint is updated before the copy replaces the file, so
+    that a crash in between is recovered by _load_checkpoint.
+
+    Returns:
+        the reopened output file positioned at its end
+    """
+    widened = _widened_path(path)
+    out.close()
+    with open(path, newline="", encoding="utf-8") as old, \
+            open(widened, "w", newline="", encoding="utf-8") as new:
+        reader = csv.reader(old)
+        writer = csv.writer(new)
+        next(reader, None)
+        writer.writerow(new_fields)
+        for row in reader:
+            writer.writerow(row + [""] * (len(new_fields) - len(row)))
+        new.flush()
+        os.fsync(new.fileno())
+    checkpoint["fields"] = new_fields
+    checkpoint["offset"] = os.path.getsize(widened)
+    _save_checkpoint(path, checkpoint)
+    os.replace(widened, path)
+    out = open(path, "r+b")
+    out.seek(0, os.SEEK_END)
+    return out
+
+
+def _put(out, item, stop):
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _prefetch(pages, out, stop):
+    """Fetch pages in the background so that network and disk overlap."""
+    try:
+        for item in pages:
+            if not _put(out, item, stop):
+                return
+        _put(out, _DONE, stop)
+    except BaseException as e:
+        _put(out, e, stop)
+
+
+def _join_timeout(client):
+    timeout = getattr(client, "timeout", None) or DEFAULT_TIMEOUT
+    if isinstance(timeout, tuple):
+        return sum(t or DEFAULT_TIMEOUT for t in timeout)
+    return timeout
+
+
+def export_downloads(client, path, format="jsonl", resume=True, prefetch=2,
+                     deadline=None):
+    """Export the complete download history of the server to a file.
+
+    Pages are requested lazily and written as soon as they arrive, so
+    memory use is bounded by ``prefetch`` pages whatever the size of the
+    history. After every page a checkpoint is stored next to the output
+    file; an interrupted export is picked up from the last finished page.
+
+    Keys that first appear on a later page are never dropped: columnar
+    blocks carry their own column names and the CSV header is widened.
+
+    Args:
+        client (Bassa): logged in client used to fetch the pages
+        path (str): output file
+        format (str): one of "jsonl", "csv" or "columnar"
+        resume (bool): continue from an existing checkpoint if there is one
+        prefetch (int): number of pages fetched ahead of the writer
+        deadline (Deadline): time budget and cancellation token of the export
+
+    Returns:
+        number of records written by this call
+    """
+    if path is None or format not in FORMATS:
+        raise IncompleteParams
+    if deadline is None:
+        deadline = Deadline()
+    checkpoint = _load_checkpoint(path, format) if resume else None
+    if checkpoint is not None:
+        out = open(path, "r+b")
+        out.truncate(checkpoint["offset"])
+        out.seek(checkpoint["offset"])
+    else:
+        out = open(path, "w+b")
+        checkpoint = {"format": format, "page": 0, "offset": 0,
+                      "fields": None}
+
+    pages = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=_prefetch,
+        args=(client.iter_download_pages(start=checkpoint["page"] + 1,
+                                         deadline=deadline),
+              pages, stop))
+    worker.daemon = True
+    worker.start()
+
+    written = 0
+    encode = _ENCODERS[format]
+    try:
+        while True:
+            try:
+                item = pages.get(timeout=0.1)
+            except queue.Empty:
+                deadline.check()
+                continue
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            page, records = item
+            if checkpoint["fields"] is None:
+                checkpoint["fields"] = _field_names(records)
+                out.write(_header(format, checkpoint["fields"]))
+            added = [name for name in _field_names(records)
+                     if name not in checkpoint["fields"]]
+            if added:
+                fields = checkpoint["fields"] + added
+                if format == "csv":
+                    out = _widen_csv(out, path, checkpoint, fields)
+                else:
+                    checkpoint["fields"] = fields
+                    _save_checkpoint(path, checkpoint)
+            out.write(encode(records, checkpoint["fields"]))
+            out.flush()
+            os.fsync(out.fileno())
+            written += len(records)
+            checkpoint["page"] = page
+            checkpoint["offset"] = out.tell()
+            _save_checkpoint(path, checkpoint)
+    finally:
+        # The prefetching thread stops at the next page once stop is set;
+        # a page still in flight ends within one request timeout, which
+        # the deadline has already cut down to the time left.
+        stop.set()
+        out.close()
+        worker.join(_join_timeout(client))
+    if os.path.exists(_checkpoint_path(path)):
+        os.remove(_checkpoint_path(path))
+    return written
+
+
+def read_columnar(path):
+    """Iterate over the records of a file written in the columnar format.
+
+    Args:
+        path (str): file written by export_downloads with format="columnar"
+
+    Returns:
+        generator of records as dicts
+    """
+    with open(path, "rb") as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise Error("{} is not a columnar export".format(path))
+        while True:
+            header = f.read(_BLOCK_HEADER.size)
+            if not header:
+                return
+            size, = _BLOCK_HEADER.unpack(header)
+            block = json.loads(zlib.decompress(f.read(size)).decode("utf-8"))
+            names = list(block["columns"])
+            for i in range(block["rows"]):
+                yield dict((name, block["columns"][name][i])
+                           for name in names)
@@ -0,0 +1,178 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pre-warming and health checking of pooled keep-alive connections."""
+
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.packages.urllib3.util.connection import is_connection_dropped
+
+logger = logging.getLogger("BassaPythonClientLibrary")
+
+
+def _connection_pool(session, url):
+    """Return the urllib3 pool the session uses for requests to ``url``
+
+    The pool is looked up the same way the adapter does when sending, as
+    newer requests key pools on TLS settings as well as on the host.
+    Adapters without a pool manager, such as the replay adapter, have no
+    pool to warm.
+    """
+    adapter = session.get_adapter(url)
+    if getattr(adapter, "poolmanager", None) is None:
+        return None
+    settings = session.merge_environment_settings(url, {}, None, None, None)
+    if hasattr(adapter, "get_connection_with_tls_context"):
+        request = session.prepare_request(requests.Request("GET", url))
+        return adapter.get_connection_with_tls_context(
+            request, settings["verify"], proxies=settings["proxies"],
+            cert=settings["cert"])
+    return adapter.get_connection(url, settings["proxies"])
+
+
+def _connect(conn, timeout=None, deadline=None):
+    """Open ``conn`` unless it is already connected
+
+    Args:
+        conn: urllib3 connection
+        timeout (float): connect timeout, or a (connect, read) tuple
+        deadline (Deadline): time budget that also bounds the connect
+    """
+    if not is_connection_dropped(conn):
+        return
+    if isinstance(timeout, tuple):
+        timeout = timeout[0]
+    if deadline is not None:
+        timeout = deadline.timeout(timeout)
+    if timeout is not None:
+        conn.timeout = timeout
+    try:
+        conn.connect()
+    except Exception as e:
+        logger.debug("Could not open connection: %s", e)
+        conn.close()
+
+
+def warm_pool(session, url, connections=4, timeout=None, deadline=None):
+    """Open keep-alive connections to ``url`` ahead of the first request
+
+    The connections are opened in parallel, so name resolution, TCP and
+    TLS handshakes are paid once during warm-up, and are left idle in the
+    pool of ``session`` for the following requests. No more connections
+    are opened than the pool keeps.
+
+    Args:
+        session (requests.Session): session whose pool is warmed
+        url (str): URL of the server
+        connections (int): number of connections to open, at most the
+        pool size
+        timeout (float): connect timeout of each connection
+        deadline (Deadline): time budget and cancellation token of the call
+
+    Returns:
+        number of connections that are open in the pool
+    """
+    if deadline is not None:
+        deadline.check()
+    pool = _connection_pool(session, url)
+    if pool is None or pool.pool is None:
+        return 0
+    # Connections beyond the pool size would be discarded when put back.
+    connections = min(connections, pool.pool.maxsize or connections)
+    conns = [pool._get_conn() for _ in range(connections)]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, connections)) as executor:
+            list(executor.map(
+                lambda conn: _connect(conn, timeout, deadline), conns))
+    finally:
+        opened = 0
+        for conn in conns:
+            if not is_connection_dropped(conn):
+                opened += 1
+            pool._put_conn(conn)
+    return opened
+
+
+def refresh_pool(session, url, timeout=None):
+    """Replace pooled connections that the server or network has dropped
+
+    Idle connections are checked one at a time. Only a dropped one is taken
+    out of the pool while it reconnects, so requests made meanwhile keep
+    finding the healthy ones.
+
+    Args:
+        session (requests.Session): session whose pool is checked
+        url (str): URL of the server
+        timeout (float): connect timeout of each replacement connection
+
+    Returns:
+        number of connections that were replaced
+    """
+    pool = _connection_pool(session, url)
+    if pool is None or pool.pool is None:
+        return 0
+    idle = pool.pool
+    with idle.mutex:
+        snapshot = [conn for conn in idle.queue if conn is not None]
+    replaced = 0
+    for conn in snapshot:
+        with idle.mutex:
+            # Skip connections a request has checked out since the snapshot.
+            if conn not in idle.queue or not is_connection_dropped(conn):
+                continue
+            idle.queue.remove(conn)
+            idle.not_full.notify()
+        conn.close()
+        _connect(conn, timeout)
+        pool._put_conn(conn)
+        replaced += 1
+    return replaced
+
+
+class KeepAliveChecker(threading.Thread):
+    """Background thread calling refresh_pool every ``interval`` seconds
+
+    Args:
+        session (requests.Session): session whose pool is checked
+        url (str): URL of the server
+        interval (float): seconds between two checks
+        timeout (float): connect timeout of each replacement connection
+    """
+    def __init__(self, session, url, interval=30, timeout=None):
+        super().__init__(name="BassaKeepAlive")
+        self.daemon = True
+        self.session = session
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                replaced = refresh_pool(self.session, self.url, self.timeout)
+            except Exception as e:
+                logger.debug("Keep-alive check failed: %s", e)
+                continue
+            if replaced:
+                logger.debug("Replaced %d dropped connections", replaced)
+
+    def stop(self):
+        """Stop checking and wait for the thread to finish"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,207 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record and replay of HTTP exchanges for offline testing and profiling."""
+
+
+import base64
+import collections
+import datetime
+import gzip
+import io
+import json
+import threading
+import time
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from bassa.errors import Error
+from bassa.utils import TimeoutHTTPAdapter
+
+
+class ReplayError(Error):
+    """Raised when a request has no recorded response left in the cassette"""
+    pass
+
+
+def _key(request):
+    body = request.body or b""
+    if not isinstance(body, bytes):
+        body = body.encode("utf-8")
+    return "{} {} {} {}".format(request.method, request.url,
+                                request.headers.get("Range", ""),
+                                base64.b64encode(body).decode("ascii"))
+
+
+class Cassette:
+    """Ordered list of recorded exchanges stored as gzipped JSON lines
+
+    Args:
+        exchanges (List): recorded exchanges as dicts
+    """
+    def __init__(self, exchanges=None):
+        self.exchanges = list(exchanges or [])
+
+    @classmethod
+    def load(cls, path):
+        """Read a cassette from ``path``"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return cls(json.loads(line) for line in f if line.strip())
+
+    def save(self, path):
+        """Write the cassette to ``path``"""
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for exchange in self.exchanges:
+                f.write(json.dumps(exchange, separators=(",", ":")) + "\n")
+
+    def add(self, request, response, elapsed=None):
+        """Append the exchange of a prepared request and its response
+
+        Args:
+            request (requests.PreparedRequest): request that was sent
+            response (requests.Response): response that was received
+            elapsed (float): seconds the exchange took, defaults to
+            ``response.elapsed``
+        """
+        if elapsed is None:
+            elapsed = response.elapsed.total_seconds()
+        self.exchanges.append({
+            "key": _key(request),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "body": base64.b64encode(response.content).decode("ascii"),
+            "elapsed": elapsed,
+        })
+
+
+class RecordingAdapter(TimeoutHTTPAdapter):
+    """Adapter sending real requests and recording them into a cassette
+
+    The cassette is written to ``path`` when the adapter is closed, which
+    happens when the session of the client is closed. Bodies are recorded
+    as soon as the response arrives, so a response requested with
+    ``stream=True`` is read into memory in full; record large downloads
+    with care.
+
+    Args:
+        path (str): cassette file to write
+    """
+    def __init__(self, path, *args, **kwargs):
+        self.path = path
+        self.cassette = Cassette()
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        # Session.send only sets response.elapsed once the adapter returns,
+        # so the exchange is timed here.
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.cassette.add(request, response, elapsed)
+        return response
+
+    def close(self):
+        with self._lock:
+            self.cassette.save(self.path)
+        super().close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Adapter answering requests from a cassette without opening sockets
+
+    Identical requests are answered in the order they were recorded.
+
+    Args:
+        cassette (Cassette): recorded exchanges
+        latency (bool): sleep for the recorded duration of every exchange
+    """
+    def __init__(self, cassette, latency=False):
+        super().__init__()
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._exchanges = collections.defaultdict(collections.deque)
+        for exchange in cassette.exchanges:
+            self._exchanges[exchange["key"]].append(exchange)
+
+    def send(self, request, **kwargs):
+        key = _key(request)
+        with self._lock:
+            recorded = self._exchanges.get(key)
+            if not recorded:
+                raise ReplayError("No recorded response for {} {}".format(
+                    request.method, request.url))
+            exchange = recorded.popleft()
+        if self.latency:
+            time.sleep(exchange["elapsed"])
+        response = Response()
+        response.status_code = exchange["status"]
+        response.reason = exchange["reason"]
+        response.headers = CaseInsensitiveDict(exchange["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = base64.b64decode(exchange["body"])
+        response._content_consumed = True
+        response.raw = io.BytesIO(response._content)
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=exchange["elapsed"])
+        return response
+
+    def close(self):
+        pass
+
+
+def record(client, path):
+    """Record every exchange of ``client`` into the cassette at ``path``
+
+    The cassette is written when ``client.http`` is closed. Streamed
+    responses, such as those of stream_file, are read into memory in full
+    while recording.
+
+    Args:
+        client (Bassa): client whose requests are recorded
+        path (str): cassette file to write
+
+    Returns:
+        the mounted RecordingAdapter
+    """
+    current = client.http.get_adapter(client.api_url)
+    adapter = RecordingAdapter(path, max_retries=current.max_retries,
+                               timeout=current.timeout,
+                               pool_connections=current._pool_connections,
+                               pool_maxsize=current._pool_maxsize)
+    client.http.mount("https://", adapter)
+    client.http.mount("http://", adapter)
+    return adapter
+
+
+def replay(client, path, latency=False):
+    """Answer every request of ``client`` from the cassette at ``path``
+
+    Args:
+        client (Bassa): client whose requests are replayed
+        path (str): cassette file to read
+        latency (bool): sleep for the recorded duration of every exchange
+
+    Returns:
+        the mounted ReplayAdapter
+    """
+    adapter = ReplayAdapter(Cassette.load(path), latency=latency)
+    client.http.mount("https://", adapter)
+    client.http.mount("http://", adapter)
+    return adapter
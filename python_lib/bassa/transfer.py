@@ -0,0 +1,311 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parallel fetching of completed files from the Bassa server."""
+
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bassa.errors import Cancelled, IncompleteParams, ResponseError
+from bassa.utils import RateLimiter, Deadline
+
+CHUNK_SIZE = 64 * 1024
+SEGMENT_SIZE = 8 * 1024 * 1024
+
+_FILENAME = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.IGNORECASE)
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+_EMPTY_RANGE = re.compile(r'bytes\s+\*/0$')
+
+
+def _filename(response, gid):
+    match = _FILENAME.search(response.headers.get('Content-Disposition', ''))
+    name = os.path.basename(match.group(1)) if match else ''
+    return name or str(gid)
+
+
+def _preallocate(path, size):
+    with open(path, "wb") as f:
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+
+class _Job:
+    """Book-keeping for a single file being fetched in segments"""
+    def __init__(self, gid):
+        self.gid = gid
+        self.path = None
+        self.pending = 1  # the first range
+        self.lock = threading.Lock()
+
+    def add_segments(self, count):
+        # Called before the segment that found them is finished, so the
+        # count cannot drop to zero while ranges are still missing.
+        with self.lock:
+            self.pending += count
+
+    def finish_segment(self):
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                os.replace(self.path + ".part", self.path)
+                return True
+        return False
+
+
+class Fetcher:
+    """Pool of workers downloading completed files under shared limits
+
+    Files can be added at any time until join() returns. All of them share
+    at most ``max_workers`` concurrent requests and one bandwidth budget.
+    When the server answers range requests with 206, a file is split into
+    byte ranges of ``segment_size`` that are fetched concurrently and
+    written in place into a preallocated ``.part`` file, renamed once
+    complete. Every request is read to the end by the task that sent it,
+    so no more than ``max_workers`` responses are open at any time. Files
+    whose names clash get their gid prepended.
+
+    Args:
+        client (Bassa): logged in client
+        dest (str): directory to write the files into
+        max_workers (int): maximum number of concurrent requests
+        bytes_per_second (int): global bandwidth budget, None for unlimited
+        segment_size (int): size of the byte ranges large files are split in
+        deadline (Deadline): time budget and cancellation token of the batch
+    """
+    def __init__(self, client, dest, max_workers=4, bytes_per_second=None,
+                 segment_size=SEGMENT_SIZE, deadline=None):
+        self.client = client
+        self.dest = dest
+        self.segment_size = segment_size
+        self.deadline = deadline if deadline is not None else Deadline()
+        self.limiter = RateLimiter(bytes_per_second)
+        self.paths = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = set()
+        self._cond = threading.Condition()
+        self._error = None
+        self._aborted = threading.Event()
+        self._names = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._abort()
+        self.close()
+
+    def add(self, gid):
+        """Queue the file ``gid`` for download"""
+        job = _Job(gid)
+        self._submit(self._probe, job, on_done=self._schedule)
+
+    def join(self):
+        """Wait until every added file is on disk
+
+        Returns:
+            dict mapping every gid to the path of its file
+        """
+        try:
+            with self._cond:
+                while self._futures and self._error is None:
+                    self._cond.wait(0.1)
+                    self.deadline.check()
+                if self._error is not None:
+                    raise self._error
+        except BaseException:
+            self._abort()
+            raise
+        return dict(self.paths)
+
+    def close(self):
+        """Stop accepting files and wait for the workers to exit"""
+        if self._error is not None:
+            self._abort()
+        self._pool.shutdown(wait=True)
+
+    def _abort(self):
+        # Queued requests are dropped; running ones stop at their next chunk.
+        self._aborted.set()
+        with self._cond:
+            for future in list(self._futures):
+                future.cancel()
+
+    def _check(self):
+        if self._aborted.is_set():
+            raise Cancelled
+        self.deadline.check()
+
+    def _submit(self, fn, *args, **kwargs):
+        on_done = kwargs.pop("on_done", None)
+        with self._cond:
+            future = self._pool.submit(fn, *args)
+            self._futures.add(future)
+        future.add_done_callback(lambda f: self._done(f, on_done))
+
+    def _done(self, future, on_done):
+        error = None
+        if not future.cancelled():
+            error = future.exception()
+            if error is None and on_done is not None:
+                # Follow-up work is queued before this future is dropped so
+                # that join() never sees an empty set in between.
+                try:
+                    on_done(future.result())
+                except BaseException as e:
+                    error = e
+        with self._cond:
+            self._futures.discard(future)
+            if error is not None and self._error is None:
+                self._error = error
+            self._cond.notify_all()
+
+    def _claim(self, name, gid):
+        with self._cond:
+            candidate = name
+            n = 0
+            while candidate in self._names:
+                n += 1
+                candidate = ("{}-{}".format(gid, name) if n == 1
+                             else "{}-{}-{}".format(gid, n, name))
+            self._names.add(candidate)
+        return os.path.join(self.dest, candidate)
+
+    def _probe(self, job):
+        """Fetch the first range and work out the remaining ones
+
+        Servers that ignore the Range header answer 200 with the full
+        body, and an empty file is answered 416 with ``bytes */0``.
+
+        Returns:
+            the job and the (start, end) ranges still to fetch
+        """
+        self._check()
+        response = self.client.stream_file(
+            id=job.gid, byte_range=(0, self.segment_size - 1),
+            deadline=self.deadline)
+        with response:
+            job.path = self._claim(_filename(response, job.gid), job.gid)
+            content_range = response.headers.get('Content-Range', '')
+            if response.status_code == 416:
+                if _EMPTY_RANGE.match(content_range) is None:
+                    raise ResponseError('Range not satisfiable for {}'.format(
+                        job.gid))
+                _preallocate(job.path + ".part", 0)
+                self._finish(job)
+                return job, []
+            match = _CONTENT_RANGE.match(content_range)
+            if response.status_code != 206 or match is None:
+                length = response.headers.get('Content-Length')
+                length = int(length) if length is not None else None
+                _preallocate(job.path + ".part", length or 0)
+                self._copy(response, job.path + ".part", 0, length)
+                self._finish(job)
+                return job, []
+            start, end, size = (int(group) for group in match.groups())
+            if start != 0:
+                raise ResponseError('Unexpected range {} for {}'.format(
+                    content_range, job.gid))
+            _preallocate(job.path + ".part", size)
+            self._copy(response, job.path + ".part", 0, end + 1)
+        return self._split(job, end + 1, size - 1)
+
+    def _split(self, job, start, end):
+        """Cut the missing bytes from start to end into segments
+
+        The current segment of ``job`` is finished afterwards.
+        """
+        segments = [(offset, min(offset + self.segment_size - 1, end))
+                    for offset in range(start, end + 1, self.segment_size)]
+        job.add_segments(len(segments))
+        self._finish(job)
+        return job, segments
+
+    def _schedule(self, result):
+        job, segments = result
+        for start, end in segments:
+            self._submit(self._segment, job, start, end,
+                         on_done=self._schedule)
+
+    def _segment(self, job, start, end):
+        """Fetch one byte range, rescheduling what a short answer left out"""
+        self._check()
+        response = self.client.stream_file(
+            id=job.gid, byte_range=(start, end), deadline=self.deadline)
+        with response:
+            match = _CONTENT_RANGE.match(
+                response.headers.get('Content-Range', ''))
+            if response.status_code != 206 or match is None \
+                    or int(match.group(1)) != start:
+                raise ResponseError(
+                    'Range request not honoured for {}'.format(job.gid))
+            received = min(int(match.group(2)), end)
+            self._copy(response, job.path + ".part", start,
+                       received - start + 1)
+        return self._split(job, received + 1, end)
+
+    def _finish(self, job):
+        if job.finish_segment():
+            with self._cond:
+                self.paths[job.gid] = job.path
+
+    def _copy(self, response, path, offset, length):
+        """Write the body of ``response`` into ``path`` at ``offset``"""
+        received = 0
+        with response, open(path, "r+b") as f:
+            f.seek(offset)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                self._check()
+                self.limiter.acquire(len(chunk), self.deadline)
+                f.write(chunk)
+                received += len(chunk)
+        if length is not None and received != length:
+            raise ResponseError(
+                'Expected {} bytes at offset {}, got {}'.format(
+                    length, offset, received))
+
+
+def fetch_files(client, gid_list, dest, max_workers=4, bytes_per_second=None,
+                segment_size=SEGMENT_SIZE, deadline=None):
+    """Download many completed files in parallel
+
+    See Fetcher for how requests and bandwidth are shared between files.
+
+    Args:
+        client (Bassa): logged in client
+        gid_list (List): identifiers of the files to fetch
+        dest (str): directory to write the files into
+        max_workers (int): maximum number of concurrent requests
+        bytes_per_second (int): global bandwidth budget, None for unlimited
+        segment_size (int): size of the byte ranges large files are split in
+        deadline (Deadline): time budget and cancellation token of the batch
+
+    Returns:
+        dict mapping every gid to the path of its file
+    """
+    if gid_list is None or dest is None:
+        raise IncompleteParams
+    with Fetcher(client, dest, max_workers=max_workers,
+                 bytes_per_second=bytes_per_second,
+                 segment_size=segment_size, deadline=deadline) as fetcher:
+        for gid in gid_list:
+            fetcher.add(gid)
+        return fetcher.join()
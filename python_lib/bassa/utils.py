@@ -14,7 +14,10 @@
 """Util classes"""
 
 
+import threading
+import time
 from requests.adapters import HTTPAdapter
+from bassa.errors import Cancelled, DeadlineExceeded
 
 DEFAULT_TIMEOUT = 5  # seconds
 
@@ -32,3 +35,89 @@ class TimeoutHTTPAdapter(HTTPAdapter):
         if timeout is None:
             kwargs["timeout"] = self.timeout
         return super().send(request, **kwargs)
+
+
+class RateLimiter:
+    """Thread safe pacer sharing a bytes-per-second budget between callers
+
+    Args:
+        rate (int): allowed bytes per second, None for unlimited
+    """
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount, deadline=None):
+        """Block until ``amount`` bytes may be transferred"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now)
+            wait = self._next - now
+            self._next += float(amount) / self.rate
+        if wait > 0:
+            if deadline is None:
+                time.sleep(wait)
+            else:
+                deadline.wait(wait)
+
+
+class Deadline:
+    """Time budget and cancellation token shared by a multi-step operation
+
+    Every request made with a deadline gets its timeout cut down to the
+    time left, and fails with DeadlineExceeded or Cancelled once the budget
+    is spent or cancel() has been called, possibly from another thread.
+
+    Args:
+        timeout (float): seconds from now until expiry, None for no limit
+    """
+    def __init__(self, timeout=None):
+        self.expires = None
+        if timeout is not None:
+            self.expires = time.monotonic() + timeout
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Cancel the operation; outstanding work stops at its next check"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """Seconds left, None when there is no time limit"""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self):
+        """Raise if the operation was cancelled or ran out of time"""
+        if self._cancelled.is_set():
+            raise Cancelled
+        if self.remaining() == 0:
+            raise DeadlineExceeded
+
+    def timeout(self, default=None):
+        """Request timeout: ``default`` cut down to the time left"""
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if default is None:
+            return remaining
+        if isinstance(default, tuple):
+            return tuple(remaining if t is None else min(t, remaining)
+                         for t in default)
+        return min(default, remaining)
+
+    def wait(self, seconds):
+        """Sleep for ``seconds`` unless cancelled or out of time first"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self._cancelled.wait(seconds)
+        self.check()
@@ -1,19 +1,49 @@
 import unittest
+import requests
 from bassa.bassa import Bassa
-from bassa.errors import InvalidUrl
+from bassa.errors import InvalidUrl, Cancelled, DeadlineExceeded
+from bassa.utils import Deadline, RateLimiter
+from bassa import compression, export, pool, replay, transfer
+from bassa.errors import ResponseError
 
 
+import csv
+import http.server
+import io
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
 import time
+from unittest import mock
 
 import logging
 import sys
 
 unittest.TestLoader.sortTestMethodsUsing = None
 
+# Set BASSA_CASSETTE to replay the suite from a cassette without a server,
+# together with BASSA_RECORD=1 to record it against a running server first.
+CASSETTE = os.environ.get("BASSA_CASSETTE")
+RECORD = os.environ.get("BASSA_RECORD") == "1"
+NO_CASSETTE = bool(CASSETTE) and not RECORD and not os.path.exists(CASSETTE)
 
+
+def tearDownModule():
+    TestBassaPythonLib.client.http.close()
+
+
+@unittest.skipIf(NO_CASSETTE, "no cassette at {}, record one with "
+                 "BASSA_RECORD=1".format(CASSETTE))
 class TestBassaPythonLib(unittest.TestCase):
 
     client = Bassa(api_url="http://localhost:5000")
+    if CASSETTE and RECORD:
+        replay.record(client, CASSETTE)
+    elif CASSETTE and not NO_CASSETTE:
+        replay.replay(client, CASSETTE)
     INVALID_URL = "hppts://localhost:5000"
     VALID_URL = "http://localhost:5000"
     TEST_USERS = [["rand", "pass", "rand@scorelab.org"],
@@ -25,7 +55,8 @@ class TestBassaPythonLib(unittest.TestCase):
 
     def __init__(self, *args, **kwargs):
         super(TestBassaPythonLib, self).__init__(*args, **kwargs)
-        self.test_login()
+        if not NO_CASSETTE:
+            self.test_login()
 
     def test_invalid_url(self):
         """Test input URL"""
@@ -36,6 +67,12 @@ class TestBassaPythonLib(unittest.TestCase):
         self.client.login(
             user_name=self.TEST_USERS[0][0], password=self.TEST_USERS[0][1])
 
+    def test_warm(self):
+        """Test pre-warming connections and logging in ahead of time"""
+        self.client.warm(connections=2, user_name=self.TEST_USERS[0][0],
+                         password=self.TEST_USERS[0][1])
+        assert self.client.headers.get('token') is not None
+
     def test_add_regular_user_request(self):
         """Test adding a regular user request"""
         self.client.add_regular_user_request(
@@ -97,6 +134,576 @@ class TestBassaPythonLib(unittest.TestCase):
         result = self.client.get_downloads_request(limit=1)
         logging.debug(result)
 
+    def test_export_downloads(self):
+        """Test exporting all download requests to a file"""
+        self.client.add_download_request(download_link=self.DOWNLOAD_LINK)
+        path = os.path.join(tempfile.mkdtemp(), "downloads.jsonl")
+        written = self.client.export_downloads(path=path)
+        with open(path) as f:
+            assert sum(1 for _ in f) == written
+        assert not os.path.exists(path + ".ckpt")
+
+
+class LocalServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Keep-alive HTTP server answering every GET with an empty list
+
+    Args:
+        delay (float): seconds to wait before answering
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.connections = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                server.connections += 1
+                http.server.BaseHTTPRequestHandler.setup(self)
+
+            def do_GET(self):
+                time.sleep(server.delay)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"[]")
+
+            def log_message(self, *args):
+                pass
+
+        http.server.HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={"poll_interval": 0.01})
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return "http://localhost:{}".format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestReplay(unittest.TestCase):
+
+    URL = "http://localhost:5000"
+
+    def test_replay_downloads(self):
+        """Test answering requests from a cassette without a server"""
+        records = [{"id": 1, "link": TestBassaPythonLib.DOWNLOAD_LINK}]
+        path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl.gz")
+        request = Bassa(api_url=self.URL).http.prepare_request(
+            requests.Request("GET", self.URL + "/api/downloads/1"))
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(records).encode("utf-8")
+        cassette = replay.Cassette()
+        cassette.add(request, response)
+        cassette.save(path)
+
+        client = Bassa(api_url=self.URL)
+        replay.replay(client, path)
+        assert client.get_downloads_request(limit=1) == records
+        self.assertRaises(replay.ReplayError,
+                          client.get_downloads_request, limit=1)
+
+    def test_replay_recorded_latency(self):
+        """Test that replaying with latency takes as long as recording"""
+        server = LocalServer(delay=0.05)
+        self.addCleanup(server.stop)
+        path = os.path.join(tempfile.mkdtemp(), "cassette.jsonl.gz")
+        client = Bassa(api_url=server.url, pool_size=3)
+        assert replay.record(client, path)._pool_maxsize == 3
+        client.get_downloads_request(limit=1)
+        client.http.close()
+        elapsed = replay.Cassette.load(path).exchanges[0]["elapsed"]
+        assert elapsed >= 0.05
+
+        client = Bassa(api_url=server.url)
+        replay.replay(client, path, latency=True)
+        start = time.monotonic()
+        assert client.get_downloads_request(limit=1) == []
+        assert time.monotonic() - start >= 0.05
+
+
+class PagedClient(Bassa):
+    """Client serving download pages from memory, failing on one page"""
+
+    def __init__(self, pages, fail_at=None):
+        super(PagedClient, self).__init__(api_url="http://localhost:5000")
+        self.pages = pages
+        self.fail_at = fail_at
+        self.requested = []
+
+    def get_downloads_request(self, limit=None, deadline=None):
+        self.requested.append(limit)
+        if limit == self.fail_at:
+            raise Exception(500)
+        return self.pages[limit - 1] if limit <= len(self.pages) else []
+
+
+class TestExport(unittest.TestCase):
+
+    PAGES = [[{"id": i, "link": "l{}".format(i)} for i in range(25)],
+             [{"id": 25, "link": "y", "size": 9}],
+             ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def test_resume_from_checkpoint(self):
+        """Test resuming an interrupted export from its last page"""
+        pages = [[{"id": p * 25 + i} for i in range(25)] for p in range(3)]
+        pages.append([{"id": 75}])
+        path = os.path.join(self.dir, "downloads.jsonl")
+        self.assertRaises(Exception, PagedClient(pages, fail_at=3)
+                          .export_downloads, path=path)
+        assert os.path.exists(path + ".ckpt")
+        client = PagedClient(pages)
+        assert client.export_downloads(path=path) == 26
+        assert client.requested == [3, 4]
+        assert not os.path.exists(path + ".ckpt")
+        with open(path) as f:
+            ids = [json.loads(line)["id"] for line in f]
+        assert ids == list(range(76))
+
+    def test_csv_keeps_late_fields(self):
+        """Test that CSV widens its header for keys of later pages"""
+        path = os.path.join(self.dir, "downloads.csv")
+        assert PagedClient(self.PAGES).export_downloads(
+            path=path, format="csv") == 26
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        assert len(rows) == 27
+        assert set(len(row) for row in rows) == {3}
+        assert rows[1] == ["0", "l0", ""]
+        assert rows[-1] == ["25", "y", "9"]
+
+    def test_csv_widening_survives_crash(self):
+        """Test resuming after a crash while the CSV header is widened"""
+        path = os.path.join(self.dir, "downloads.csv")
+        replace = os.replace
+
+        def crash(src, dst):
+            if src.endswith(".widen"):
+                raise OSError("crash")
+            replace(src, dst)
+
+        with mock.patch.object(export.os, "replace", side_effect=crash):
+            self.assertRaises(OSError, PagedClient(self.PAGES)
+                              .export_downloads, path=path, format="csv")
+        client = PagedClient(self.PAGES)
+        assert client.export_downloads(path=path, format="csv") == 1
+        assert client.requested == [2]
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == ["id", "link", "size"]
+        assert len(rows) == 27
+        assert set(len(row) for row in rows) == {3}
+
+    def test_columnar_round_trip(self):
+        """Test reading back a columnar export with keys of later pages"""
+        path = os.path.join(self.dir, "downloads.bcol")
+        PagedClient(self.PAGES).export_downloads(path=path, format="columnar")
+        records = list(export.read_columnar(path))
+        assert records[:25] == self.PAGES[0]
+        assert records[25] == {"id": 25, "link": "y", "size": 9}
+
+
+class FileClient(Bassa):
+    """Client serving files from memory, with or without range support
+
+    Args:
+        files (dict): (name, data) of every file id
+        ranges (bool): answer range requests with 206
+        max_range (int): most bytes answered to a single range request
+    """
+
+    def __init__(self, files, ranges=True, max_range=None):
+        super(FileClient, self).__init__(api_url="http://localhost:5000")
+        self.files = files
+        self.ranges = ranges
+        self.max_range = max_range
+        self.requested = []
+        self.open = 0
+        self.max_open = 0
+        self._lock = threading.Lock()
+
+    def stream_file(self, id=None, byte_range=None, deadline=None):
+        self.requested.append((id, byte_range))
+        name, data = self.files[id]
+        response = requests.Response()
+        response.headers['Content-Disposition'] = \
+            'attachment; filename="{}"'.format(name)
+        if self.ranges and byte_range is not None and not data:
+            response.status_code = 416
+            response.headers['Content-Range'] = 'bytes */0'
+        elif self.ranges and byte_range is not None:
+            start, end = byte_range[0], min(byte_range[1], len(data) - 1)
+            if self.max_range is not None:
+                end = min(end, start + self.max_range - 1)
+            response.status_code = 206
+            response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, len(data))
+            data = data[start:end + 1]
+        else:
+            response.status_code = 200
+        response.headers['Content-Length'] = str(len(data))
+        response.raw = OpenBody(data, self)
+        return response
+
+    def opened(self, count):
+        with self._lock:
+            self.open += count
+            self.max_open = max(self.max_open, self.open)
+
+
+class OpenBody(io.BytesIO):
+    """Response body counting itself as open on its client until closed"""
+
+    def __init__(self, data, client):
+        super(OpenBody, self).__init__(data)
+        self.client = client
+        client.opened(1)
+
+    def close(self):
+        if not self.closed:
+            self.client.opened(-1)
+        super(OpenBody, self).close()
+
+
+class TestTransfer(unittest.TestCase):
+
+    DATA = os.urandom(10000)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_segments_are_reassembled(self):
+        """Test fetching a file as byte ranges written in place"""
+        client = FileClient({1: ("a.bin", self.DATA)})
+        paths = transfer.fetch_files(client, [1], self.dir,
+                                     segment_size=1024)
+        assert self.read(paths[1]) == self.DATA
+        assert len(client.requested) == 10
+        assert os.listdir(self.dir) == ["a.bin"]
+
+    def test_whole_file_without_range_support(self):
+        """Test falling back to one request when ranges are ignored"""
+        client = FileClient({1: ("a.bin", self.DATA)}, ranges=False)
+        paths = transfer.fetch_files(client, [1], self.dir,
+                                     segment_size=1024)
+        assert self.read(paths[1]) == self.DATA
+        assert len(client.requested) == 1
+
+    def test_same_names_do_not_collide(self):
+        """Test that files sharing a name are written to distinct paths"""
+        other = os.urandom(3000)
+        client = FileClient({1: ("a.bin", self.DATA), 2: ("a.bin", other)})
+        paths = transfer.fetch_files(client, [1, 2], self.dir,
+                                     segment_size=1024)
+        assert paths[1] != paths[2]
+        assert sorted([self.read(paths[1]), self.read(paths[2])]) == \
+            sorted([self.DATA, other])
+
+    def test_short_ranges_are_completed(self):
+        """Test fetching the bytes left out of shorter range answers"""
+        client = FileClient({1: ("a.bin", self.DATA)}, max_range=500)
+        paths = transfer.fetch_files(client, [1], self.dir,
+                                     segment_size=1024)
+        assert self.read(paths[1]) == self.DATA
+
+    def test_empty_file(self):
+        """Test fetching a file the server answers 416 for"""
+        client = FileClient({1: ("a.bin", b"")})
+        paths = transfer.fetch_files(client, [1], self.dir)
+        assert self.read(paths[1]) == b""
+
+    def test_open_responses_are_bounded(self):
+        """Test that no more than max_workers responses are ever open"""
+        files = dict((id, ("{}.bin".format(id), os.urandom(3000)))
+                     for id in range(50))
+        client = FileClient(files)
+        paths = transfer.fetch_files(client, list(files), self.dir,
+                                     max_workers=2, segment_size=1024)
+        assert len(paths) == 50
+        assert client.max_open <= 2
+        assert client.open == 0
+
+    def test_rate_limiter_paces_transfers(self):
+        """Test that the limiter spreads bytes over the budgeted time"""
+        limiter = RateLimiter(1000000)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.acquire(50000)
+        assert 0.09 <= time.monotonic() - start < 0.5
+
+
+class CompressionClient(FileClient):
+    """Client whose compression jobs report scripted progress values"""
+
+    def __init__(self, progress):
+        files = dict((id, ("{}.zip".format(id), os.urandom(2000)))
+                     for id in progress)
+        super(CompressionClient, self).__init__(files)
+        self.progress = progress
+        self.batches = []
+        self.events = []
+
+    def start_compression(self, gid_list=None, deadline=None):
+        self.batches.append(gid_list)
+        return {"process_id": len(self.batches)}
+
+    def get_compression_progress(self, id=None, deadline=None):
+        self.events.append(("poll", id))
+        values = self.progress[id]
+        return values.pop(0) if len(values) > 1 else values[0]
+
+    def stream_file(self, id=None, byte_range=None, deadline=None):
+        self.events.append(("fetch", id))
+        return super(CompressionClient, self).stream_file(
+            id=id, byte_range=byte_range, deadline=deadline)
+
+
+class TestCompression(unittest.TestCase):
+
+    DONE = {"progress": 100}
+    RUNNING = {"progress": 50}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def run_jobs(self, client, gids, **kwargs):
+        return compression.compress_and_fetch(
+            client, gids, self.dir, poll_interval=0.01, **kwargs)
+
+    def test_is_complete(self):
+        """Test reading the progress answered by the server"""
+        assert compression.is_complete(self.DONE)
+        assert not compression.is_complete(self.RUNNING)
+        for progress in (None, {}, {"progress": "failed"},
+                         {"progress": -1}, {"progress": True}):
+            self.assertRaises(ResponseError, compression.is_complete,
+                              progress)
+
+    def test_large_lists_are_batched(self):
+        """Test splitting the gids into jobs of batch_size files"""
+        client = CompressionClient({1: [self.DONE], 2: [self.DONE],
+                                    3: [self.DONE]})
+        ids = self.run_jobs(client, list(range(250)), batch_size=100)
+        assert ids == [1, 2, 3]
+        assert [len(b) for b in client.batches] == [100, 100, 50]
+        assert sorted(os.listdir(self.dir)) == ["1.zip", "2.zip", "3.zip"]
+
+    def test_single_job_returns_its_id(self):
+        """Test returning the compression id of a single job"""
+        client = CompressionClient({1: [self.DONE]})
+        assert self.run_jobs(client, [10, 20]) == 1
+
+    def test_open_downloads_are_bounded(self):
+        """Test that archives share max_workers open downloads"""
+        client = CompressionClient(dict((id, [self.DONE])
+                                        for id in range(1, 7)))
+        self.run_jobs(client, list(range(6)), batch_size=1, max_workers=2)
+        assert len(os.listdir(self.dir)) == 6
+        assert client.max_open <= 2
+        assert client.open == 0
+
+    def test_archives_are_fetched_early(self):
+        """Test fetching a finished archive before slower jobs are done"""
+        client = CompressionClient({
+            1: [self.DONE],
+            2: [self.RUNNING, self.RUNNING, self.RUNNING, self.DONE]})
+        self.run_jobs(client, [10, 20], batch_size=1)
+        assert client.events.index(("fetch", 1)) < \
+            client.events.index(("fetch", 2))
+        last_poll = len(client.events) - 1 - \
+            client.events[::-1].index(("poll", 2))
+        assert client.events.index(("fetch", 1)) < last_poll
+
+    def test_failed_job_stops_polling(self):
+        """Test that an unreadable progress raises instead of polling"""
+        client = CompressionClient({1: [self.RUNNING, None]})
+        self.assertRaises(ResponseError, self.run_jobs, client, [10])
+
+    def test_max_wait(self):
+        """Test giving up on jobs that never finish"""
+        client = CompressionClient({1: [self.RUNNING]})
+        self.assertRaises(ResponseError, self.run_jobs, client, [10],
+                          max_wait=0.05)
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer()
+        self.addCleanup(self.server.stop)
+        self.client = Bassa(api_url=self.server.url)
+        self.addCleanup(self.client.close)
+
+    def connections(self, expected):
+        """Server-side connection count, once it has settled on expected"""
+        for _ in range(50):
+            if self.server.connections >= expected:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        return self.server.connections
+
+    def test_warm_connections_are_reused(self):
+        """Test that requests after warm-up open no new connection"""
+        assert self.client.warm(connections=3) == 3
+        assert self.connections(3) == 3
+        assert self.client.get_downloads_request(limit=1) == []
+        assert self.connections(3) == 3
+
+    def test_warm_is_capped_by_pool_size(self):
+        """Test that warm-up opens no more connections than are pooled"""
+        client = Bassa(api_url=self.server.url, pool_size=2)
+        self.addCleanup(client.close)
+        assert client.warm(connections=5) == 2
+        assert self.connections(2) == 2
+
+    def test_keepalive_checker_runs_until_close(self):
+        """Test that warm starts the keep-alive checker and close stops it"""
+        self.client.warm(connections=1, keepalive_interval=0.01)
+        checker = self.client._keepalive
+        assert checker.is_alive()
+        idle = pool._connection_pool(self.client.http, self.server.url).pool
+        for conn in list(idle.queue):
+            if conn is not None:
+                conn.close()
+        assert self.connections(2) == 2
+        self.client.close()
+        assert self.client._keepalive is None
+        assert not checker.is_alive()
+
+    def test_refresh_replaces_dropped_connections(self):
+        """Test that the keep-alive check reopens dropped connections"""
+        self.client.warm(connections=2)
+        idle = pool._connection_pool(self.client.http, self.server.url).pool
+        for conn in list(idle.queue):
+            if conn is not None:
+                conn.close()
+        assert pool.refresh_pool(self.client.http, self.server.url) == 2
+        assert self.connections(4) == 4
+        assert pool.refresh_pool(self.client.http, self.server.url) == 0
+
+    def test_warm_respects_connect_timeout(self):
+        """Test that warming an unresponsive host gives up after timeout"""
+        # A listener whose single backlog slot is taken drops further SYNs,
+        # so connecting to it hangs until the connect timeout.
+        listener = socket.socket()
+        self.addCleanup(listener.close)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(0)
+        filler = socket.create_connection(listener.getsockname())
+        self.addCleanup(filler.close)
+        client = Bassa(api_url="http://localhost:{}".format(
+            listener.getsockname()[1]), timeout=0.1)
+        start = time.monotonic()
+        assert client.warm(connections=2) == 0
+        assert time.monotonic() - start < 2
+
+    def test_warm_respects_deadline(self):
+        """Test that warming stops once the deadline has expired"""
+        self.assertRaises(DeadlineExceeded, self.client.warm,
+                          connections=2, deadline=Deadline(0))
+
+
+class SlowPagedClient(PagedClient):
+    """Paged client whose requests take a while to answer"""
+
+    def __init__(self, pages, delay):
+        super(SlowPagedClient, self).__init__(pages)
+        self.delay = delay
+        self.in_flight = 0
+
+    def get_downloads_request(self, limit=None, deadline=None):
+        self.in_flight += 1
+        time.sleep(self.delay)
+        self.in_flight -= 1
+        return super(SlowPagedClient, self).get_downloads_request(
+            limit=limit, deadline=deadline)
+
+
+class TestDeadline(unittest.TestCase):
+
+    client = Bassa(api_url="http://localhost:5000")
+
+    def test_expired_deadline(self):
+        """Test that no request is sent once the deadline has expired"""
+        self.assertRaises(DeadlineExceeded, self.client.get_download,
+                          id=1, deadline=Deadline(0))
+
+    def test_cancelled_export_waits_for_prefetch(self):
+        """Test that a cancelled export returns once its request is done"""
+        client = SlowPagedClient([[{"id": 1}]], delay=0.2)
+        deadline = Deadline()
+        threading.Timer(0.02, deadline.cancel).start()
+        path = os.path.join(tempfile.mkdtemp(), "downloads.jsonl")
+        self.assertRaises(Cancelled, client.export_downloads, path=path,
+                          deadline=deadline)
+        assert client.in_flight == 0
+
+    def assertPrompt(self, exception, fn, *args, **kwargs):
+        start = time.monotonic()
+        self.assertRaises(exception, fn, *args, **kwargs)
+        assert time.monotonic() - start < 0.5
+
+    def test_cancelled_fetch_returns_promptly(self):
+        """Test that cancelling fetch_files stops transfers in progress"""
+        client = FileClient({1: ("a.bin", os.urandom(200000))})
+        deadline = Deadline()
+        threading.Timer(0.05, deadline.cancel).start()
+        self.assertPrompt(Cancelled, transfer.fetch_files, client, [1],
+                          tempfile.mkdtemp(), bytes_per_second=100000,
+                          segment_size=65536, deadline=deadline)
+        assert client.open == 0
+
+    def test_expired_fetch_returns_promptly(self):
+        """Test that fetch_files gives up once its deadline has expired"""
+        client = FileClient({1: ("a.bin", os.urandom(200000))})
+        self.assertPrompt(DeadlineExceeded, transfer.fetch_files, client,
+                          [1], tempfile.mkdtemp(), bytes_per_second=100000,
+                          segment_size=65536, deadline=Deadline(0.05))
+        assert client.open == 0
+
+    def test_cancelled_compression_returns_promptly(self):
+        """Test that cancelling compress_and_fetch stops the download"""
+        client = CompressionClient({1: [TestCompression.DONE]})
+        client.files[1] = ("1.zip", os.urandom(200000))
+        deadline = Deadline()
+        threading.Timer(0.05, deadline.cancel).start()
+        self.assertPrompt(Cancelled, compression.compress_and_fetch, client,
+                          [10], tempfile.mkdtemp(), bytes_per_second=100000,
+                          deadline=deadline)
+        assert client.open == 0
+
+    def test_expired_compression_returns_promptly(self):
+        """Test that compress_and_fetch stops polling at its deadline"""
+        client = CompressionClient({1: [TestCompression.RUNNING]})
+        self.assertPrompt(DeadlineExceeded, compression.compress_and_fetch,
+                          client, [10], tempfile.mkdtemp(),
+                          poll_interval=10, deadline=Deadline(0.05))
+
+    def test_cancelled_deadline(self):
+        """Test that no request is sent once the deadline is cancelled"""
+        deadline = Deadline(60)
+        deadline.cancel()
+        self.assertRaises(Cancelled, self.client.get_downloads_request,
+                          limit=1, deadline=deadline)
+
 
 if __name__ == '__main__':
     logging.basicConfig(stream=sys.stderr)